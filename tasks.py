@@ -1,10 +1,17 @@
+import functools
+import json
 import os
+import re
+import shlex
+import sys
 import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from shutil import which
-from subprocess import call
+from shutil import copy, rmtree
+from subprocess import DEVNULL, PIPE, Popen, call
+from threading import Thread
 
-import semver
 from invoke import run as invoke_run
 from invoke import task
 from termcolor import cprint
@@ -25,11 +32,43 @@ Version {version_string}
 {underline}
 """
 
+# SemVer 2.0 grammar, see https://semver.org/#spec-item-9
+_NUMERIC = r"0|[1-9]\d*"
+_PRERELEASE_ID = rf"(?:{_NUMERIC}|\d*[A-Za-z-][0-9A-Za-z-]*)"
+_BUILD_ID = r"[0-9A-Za-z-]+"
+SEMVER_RE = re.compile(
+    rf"({_NUMERIC})\.({_NUMERIC})\.({_NUMERIC})"
+    rf"(?:-({_PRERELEASE_ID}(?:\.{_PRERELEASE_ID})*))?"
+    rf"(?:\+({_BUILD_ID}(?:\.{_BUILD_ID})*))?"
+)
+DOCS_VERSION_RE = re.compile(r"^dash_bootstrap_components\b.*$", re.M)
+
+# number of trailing lines of command output kept for error reports
+OUTPUT_LINES = 1000
+
 HERE = Path(__file__).parent
 
 DASH_BOOTSTRAP_DIR = HERE / "dash_bootstrap_components"
 JS_DIR = HERE
 
+# examples used in the documentation, as (source, destination) pairs
+EXAMPLES_DIR = HERE / "examples"
+DOCS_EXAMPLES_DIR = HERE / "docs" / "examples" / "vendor"
+EXAMPLE_COPIES = (
+    (
+        EXAMPLES_DIR / "gallery" / "iris-kmeans" / "app.py",
+        DOCS_EXAMPLES_DIR / "iris.py",
+    ),
+    (
+        EXAMPLES_DIR / "advanced-component-usage" / "graphs_in_tabs.py",
+        DOCS_EXAMPLES_DIR / "graphs_in_tabs.py",
+    ),
+    (
+        EXAMPLES_DIR / "multi-page-apps" / "simple_sidebar.py",
+        DOCS_EXAMPLES_DIR / "simple_sidebar.py",
+    ),
+)
+
 
 @task(help={"version": "Version number to release"})
 def prerelease(ctx, version):
@@ -75,16 +114,18 @@ def release(ctx, version):
     build_publish(version)
 
     info("Committing version changes")
-    run(f"git checkout -b release-{version}")
-    run(
-        "git add package.json package-lock.json "
-        "docs/requirements.txt "
-        "dash_bootstrap_components/_version.py"
+    run_script(
+        [
+            f"git checkout -b release-{version}",
+            "git add package.json package-lock.json "
+            "docs/requirements.txt "
+            "dash_bootstrap_components/_version.py",
+            f'git commit -m "Bump version to {version}"',
+        ]
     )
-    run(f'git commit -m "Bump version to {version}"')
     info(f"Tagging version {version} and pushing to GitHub")
     run(f'git tag -a "{version}" -F changelog.tmp')
-    run(f"git push origin release-{version} --tags")
+    git_push_refs(f"release-{version}", tags=[version])
 
 
 @task
@@ -93,16 +134,8 @@ def copy_examples(ctx):
     Copy examples used in documentation to the docs directory.
     """
     info("copying examples into docs directory")
-    # TODO: have this determined by some configuration rather than hardcoded
-    run("cp examples/gallery/iris-kmeans/app.py docs/examples/vendor/iris.py")
-    run(
-        "cp examples/advanced-component-usage/graphs_in_tabs.py "
-        "docs/examples/vendor/graphs_in_tabs.py"
-    )
-    run(
-        "cp examples/multi-page-apps/simple_sidebar.py "
-        "docs/examples/vendor/simple_sidebar.py"
-    )
+    for src, dst in EXAMPLE_COPIES:
+        copy(src, dst)
 
 
 @task(copy_examples)
@@ -113,9 +146,9 @@ def documentation(ctx):
     info("Pushing documentation to Heroku")
     run("git checkout -b inv-push-docs")
     run("git add docs/examples/vendor/*.py -f")
-    run('git commit -m "Add examples" --allow-empty')
+    run('git commit -m "Add examples" --allow-empty --no-verify')
     run("git subtree split --prefix docs -b inv-push-docs-subtree")
-    run("git push -f heroku inv-push-docs-subtree:master")
+    run("git push -f --no-verify heroku inv-push-docs-subtree:master")
     run("git checkout master")
     run("git branch -D inv-push-docs inv-push-docs-subtree")
 
@@ -134,7 +167,8 @@ def postrelease(ctx, version):
      - bump the version to the next dev version
      - push changes to master
     """
-    new_version = semver.bump_patch(version) + "-dev"
+    major, minor, patch, _, _ = parse_version(version)
+    new_version = f"{major}.{minor}.{patch + 1}-dev"
     info(f"Bumping version numbers to {new_version} and committing")
     set_pyversion(new_version)
     set_jsversion(new_version)
@@ -144,7 +178,18 @@ def postrelease(ctx, version):
         "dash_bootstrap_components/_version.py"
     )
     run('git commit -m "Back to dev"')
-    run(f"git push origin postrelease-{version}")
+    git_push_refs(f"postrelease-{version}")
+
+
+def git_push_refs(branch, tags=()):
+    """
+    Push a branch and the given tags to origin in a single atomic push.
+    Tags are pushed by explicit refspec rather than with --tags, so the
+    push only negotiates the refs being released however many local tags
+    exist.
+    """
+    refspecs = [branch] + [f"refs/tags/{tag}" for tag in tags]
+    run(f"git push --atomic origin {' '.join(refspecs)}")
 
 
 def build_publish(version):
@@ -155,7 +200,26 @@ def build_publish(version):
     set_jsversion(version)
     info("Building JavaScript components")
     build_js()
-    info("Building and uploading Python source distribution")
+    info("Publishing JavaScript and building Python source distribution")
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [
+            executor.submit(publish_js),
+            executor.submit(build_python_sdist),
+        ]
+    # report failures only once both workers are done, so their output
+    # isn't interleaved
+    failures = [
+        future.exception()
+        for future in futures
+        if future.exception() is not None
+    ]
+    for failure in failures:
+        if not isinstance(failure, CommandError):
+            raise failure
+        report_failure(failure)
+    if failures:
+        exit(failures[0].returncode)
+    info("Uploading Python source distribution")
     info("PyPI credentials:")
     release_python_sdist()
 
@@ -163,21 +227,31 @@ def build_publish(version):
 def clean():
     paths_to_clean = ["dash_bootstrap_components/_components", "dist/", "lib/"]
     for path in paths_to_clean:
-        run(f"rm -rf {path}")
+        rmtree(HERE / path, ignore_errors=True)
 
 
 def build_js():
-    os.chdir(JS_DIR)
-    try:
-        run("npm install")
-        run("npm publish")
-    finally:
-        os.chdir(HERE)
+    run("npm install && NODE_ENV=production npm run build", cwd=JS_DIR)
+
+
+def publish_js():
+    # components were generated by build_js, so skip the prepublishOnly
+    # rebuild to avoid rewriting them while the sdist is being built
+    execute(
+        "NODE_ENV=production npm run build:lib && "
+        "npm publish --ignore-scripts",
+        cwd=JS_DIR,
+    )
+
+
+def build_python_sdist():
+    for path in (HERE / "dist").glob("*"):
+        path.unlink(missing_ok=True)
+    execute("python setup.py sdist")
 
 
 def release_python_sdist():
-    run("rm -f dist/*")
-    run("python setup.py sdist")
+    sys.stdout.flush()
     invoke_run("twine upload dist/*")
 
 
@@ -195,26 +269,27 @@ def set_pyversion(version):
 def set_jsversion(version):
     version = normalize_version(version)
     package_json_path = HERE / "package.json"
-    with package_json_path.open() as f:
-        package_json = f.readlines()
-    for iline, line in enumerate(package_json):
-        if '"version"' in line:
-            package_json[iline] = f'  "version": "{version}",\n'
-    with open(package_json_path, "w") as f:
-        f.writelines(package_json)
+    package_json = json.loads(package_json_path.read_text())
+    package_json["version"] = version
+    package_json_path.write_text(
+        json.dumps(package_json, indent=2, ensure_ascii=False) + "\n"
+    )
 
 
 def set_documentation_version(version):
     version = normalize_version(version)
     docs_requirements_path = HERE / "docs" / "requirements.txt"
-    with docs_requirements_path.open() as f:
-        docs_requirements = f.readlines()
-    for iline, line in enumerate(docs_requirements):
-        if "dash_bootstrap_components" in line:
-            updated_line = f"dash_bootstrap_components=={version}\n"
-            docs_requirements[iline] = updated_line
-    with open(docs_requirements_path, "w") as f:
-        f.writelines(docs_requirements)
+    docs_requirements = docs_requirements_path.read_text()
+    docs_requirements, count = DOCS_VERSION_RE.subn(
+        f"dash_bootstrap_components=={version}", docs_requirements, count=1
+    )
+    if count == 0:
+        error(
+            "No dash_bootstrap_components requirement found in "
+            f"{docs_requirements_path}"
+        )
+        exit(1)
+    docs_requirements_path.write_text(docs_requirements)
 
 
 def get_release_notes(version):
@@ -236,46 +311,127 @@ def get_release_notes(version):
 
 def open_editor(initial_message):
     editor = os.environ.get("EDITOR", "vim")
-    tmp = tempfile.NamedTemporaryFile(suffix=".tmp")
-    fname = tmp.name
+    with tempfile.NamedTemporaryFile(mode="w+", suffix=".tmp") as tmp:
+        tmp.write(initial_message)
+        tmp.flush()
+        os.fsync(tmp.fileno())
 
-    with open(fname, "w") as f:
-        f.write(initial_message)
-        f.flush()
+        sys.stdout.flush()
+        call([editor, tmp.name], close_fds=True)
 
-    call([editor, fname], close_fds=True)
-
-    with open(fname, "r") as f:
-        lines = f.readlines()
+        # re-open by name rather than reading from tmp, since some editors
+        # save by replacing the file rather than writing to it in place
+        with open(tmp.name) as f:
+            lines = f.readlines()
 
     return lines
 
 
 def check_prerequisites():
-    for executable in ["twine", "npm", "dash-generate-components"]:
-        if which(executable) is None:
-            error(
-                f"{executable} executable not found. "
-                f"You must have {executable} to release "
-                "dash-bootstrap-components."
-            )
-            exit(127)
-
-
+    executables = ["twine", "npm", "dash-generate-components"]
+    result = invoke_run(
+        f"command -v {' '.join(executables)}", hide=True, warn=True
+    )
+    found = {Path(line).name for line in result.stdout.splitlines()}
+    missing = [
+        executable for executable in executables if executable not in found
+    ]
+    if missing:
+        error(
+            f"{', '.join(missing)} executable(s) not found. "
+            f"You must have {', '.join(executables)} to release "
+            "dash-bootstrap-components."
+        )
+        exit(127)
+
+
+def parse_version(version):
+    match = SEMVER_RE.fullmatch(version)
+    if match is None:
+        raise ValueError(f"{version} is not a valid SemVer string")
+    major, minor, patch, pre_release, build = match.groups()
+    return int(major), int(minor), int(patch), pre_release, build
+
+
+@functools.lru_cache(maxsize=32)
 def normalize_version(version):
-    version_info = semver.parse_version_info(version)
-    version_string = str(version_info)
+    major, minor, patch, pre_release, build = parse_version(version)
+    version_string = f"{major}.{minor}.{patch}"
+    if pre_release:
+        version_string += f"-{pre_release}"
+    if build:
+        version_string += f"+{build}"
     return version_string
 
 
-def run(command, **kwargs):
-    result = invoke_run(command, hide=True, warn=True, **kwargs)
-    if result.exited != 0:
-        error(f"Error running {command}")
-        print(result.stdout)
-        print()
-        print(result.stderr)
-        exit(result.exited)
+class CommandError(Exception):
+    def __init__(self, command, returncode, stdout, stderr):
+        super().__init__(f"Error running {command}")
+        self.command = command
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+def execute(command, cwd=None):
+    """
+    Run a shell command with stdin closed, raising CommandError if it fails.
+    Only the last OUTPUT_LINES lines of output are kept for the error.
+    """
+    # info() output is buffered, flush it so it is ordered correctly with
+    # respect to the subprocess
+    sys.stdout.flush()
+    process = Popen(
+        command,
+        shell=True,
+        stdin=DEVNULL,
+        stdout=PIPE,
+        stderr=PIPE,
+        cwd=cwd,
+        encoding="utf-8",
+        errors="replace",
+    )
+    stdout = deque(maxlen=OUTPUT_LINES)
+    stderr = deque(maxlen=OUTPUT_LINES)
+    readers = [
+        Thread(target=stdout.extend, args=(process.stdout,)),
+        Thread(target=stderr.extend, args=(process.stderr,)),
+    ]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+    if process.wait() != 0:
+        raise CommandError(
+            command, process.returncode, "".join(stdout), "".join(stderr)
+        )
+
+
+def run(command, cwd=None):
+    """
+    Run a shell command, reporting its output and exiting if it fails.
+    """
+    try:
+        execute(command, cwd=cwd)
+    except CommandError as exc:
+        report_failure(exc)
+        exit(exc.returncode)
+
+
+def report_failure(exc):
+    error(str(exc))
+    print(exc.stdout)
+    print()
+    print(exc.stderr)
+
+
+def run_script(lines, cwd=None):
+    """
+    Run several shell commands in a single bash process, stopping at the
+    first command that fails.
+    """
+    script = "\n".join(lines)
+    run(f"bash -ec {shlex.quote(script)}", cwd=cwd)
 
 
 def error(text):